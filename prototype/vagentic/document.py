@@ -5,13 +5,32 @@
 # @Software:VeSync
 
 from __future__ import annotations
+from hashlib import md5
 from typing import Optional, Dict, Any, List
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, PrivateAttr
 
 from vagents.vagentic.emb.base import Emb
 
 
+class _ContentCache:
+    """Cleaned content and hash for one content value. Derived from `content`, so it never makes documents unequal"""
+
+    __slots__ = ("content", "cleaned_content", "content_hash")
+
+    def __init__(self, content: str):
+        self.content = content
+        # PostgreSQL TEXT cannot store NUL. str.replace scans with memchr and returns the same
+        # string when there is nothing to replace; str.translate is far slower for non-ASCII targets
+        self.cleaned_content = content.replace("\x00", "\ufffd")
+        self.content_hash = md5(self.cleaned_content.encode()).hexdigest()
+
+    def __eq__(self, other: object) -> bool:
+        return True
+
+    __hash__ = None
+
+
 class Document(BaseModel):
     """Model for managing a document"""
 
@@ -25,6 +44,8 @@ class Document(BaseModel):
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
+    _content_cache: Optional[_ContentCache] = PrivateAttr(default=None)
+
     def embed(self, embedder: Optional[Emb] = None) -> None:
         """Embed the document using the provided embedder"""
 
@@ -36,6 +57,25 @@ class Document(BaseModel):
         else:
             self.embedding = _embedder.get_embedding(self.content)
 
+    def _cached_content(self) -> _ContentCache:
+        """Returns the cleaned content and hash, recomputed only when `content` has been replaced"""
+
+        if self._content_cache is None or self._content_cache.content is not self.content:
+            self._content_cache = _ContentCache(self.content)
+        return self._content_cache
+
+    @property
+    def cleaned_content(self) -> str:
+        """Returns the content with NUL characters replaced, as stored in the database"""
+
+        return self._cached_content().cleaned_content
+
+    @property
+    def content_hash(self) -> str:
+        """Returns the md5 hex digest of the cleaned content, computed once per content value"""
+
+        return self._cached_content().content_hash
+
     def to_dict(self) -> Dict[str, Any]:
         """Returns a dictionary representation of the document"""
 
@@ -17,4 +17,7 @@ class Emb(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
     def get_embedding(self, text: str) -> List[float]:
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [self.get_embedding(text) for text in texts]
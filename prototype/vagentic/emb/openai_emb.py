@@ -5,7 +5,7 @@
 # @Software:VeSync
 
 from os import getenv
-from typing import Optional, Dict, List, Tuple, Any
+from typing import Optional, Dict, List, Tuple, Any, Union
 
 from typing_extensions import Literal
 
@@ -28,6 +28,7 @@ class OpenAIEmb(Emb):
     request_params: Optional[Dict[str, Any]] = None
     client_params: Optional[Dict[str, Any]] = None
     openai_client: Optional[OpenAIClient] = None
+    max_batch_size: int = 2048
 
     @property
     def client(self) -> OpenAIClient:
@@ -45,7 +46,7 @@ class OpenAIEmb(Emb):
             _client_params.update(self.client_params)
         return OpenAIClient(**_client_params)
 
-    def _response(self, text: str) -> CreateEmbeddingResponse:
+    def _response(self, text: Union[str, List[str]]) -> CreateEmbeddingResponse:
         _request_params: Dict[str, Any] = {
             "input": text,
             "model": self.model,
@@ -67,6 +68,25 @@ class OpenAIEmb(Emb):
             print(f'get embedding failed: {e}')
             return []
 
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self.get_embeddings_and_usage(texts)[0]
+
+    def get_embeddings_and_usage(self, texts: List[str]) -> Tuple[List[List[float]], List[Optional[Dict]]]:
+        """
+        Embed `texts` in batched requests. The API reports usage per request, not per input, so each
+        text gets its request's totals with `batch_size` set to the number of inputs they cover.
+        """
+        embeddings: List[List[float]] = []
+        usages: List[Optional[Dict]] = []
+        # The embeddings endpoint accepts at most `max_batch_size` inputs per request
+        for i in range(0, len(texts), self.max_batch_size):
+            batch = texts[i:i + self.max_batch_size]
+            response: CreateEmbeddingResponse = self._response(text=batch)
+            embeddings.extend(data.embedding for data in sorted(response.data, key=lambda data: data.index))
+            usage = {"batch_size": len(batch), **response.usage.model_dump()}
+            usages.extend(dict(usage) for _ in batch)
+        return embeddings, usages
+
     def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
         response: CreateEmbeddingResponse = self._response(text=text)
 
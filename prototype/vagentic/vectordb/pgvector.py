@@ -4,25 +4,33 @@
 # @File:pgvector.py
 # @Software:VeSync
 
-from hashlib import md5
-from typing import Optional, List, Union, Dict, Any
-
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from threading import Lock
+from typing import Optional, List, Union, Dict, Any, Iterator, Iterable, Set, Tuple
+
+import numpy as np
 from pydantic import BaseModel
 from tqdm import tqdm
+from typing_extensions import Literal
 
 try:
+    from sqlalchemy import event
     from sqlalchemy.dialects import postgresql
-    from sqlalchemy.engine import create_engine, Engine
+    from sqlalchemy.engine import create_engine, make_url, Connection, Engine
+    from sqlalchemy.exc import ProgrammingError
     from sqlalchemy.inspection import inspect
     from sqlalchemy.orm import Session, sessionmaker
-    from sqlalchemy.schema import MetaData, Table, Column
-    from sqlalchemy.sql.expression import text, func, select
-    from sqlalchemy.types import DateTime, String
+    from sqlalchemy.schema import MetaData, Table, Column, Computed, Index
+    from sqlalchemy.sql.expression import text, func, select, exists, bindparam, cast
+    from sqlalchemy.types import DateTime, String, Float
 except ImportError:
     raise ImportError("`sqlalchemy` not installed, please install it via `pip install sqlalchemy`.")
 
 try:
-    from pgvector.sqlalchemy import Vector
+    from pgvector.sqlalchemy import Vector, HALFVEC, BIT
 except ImportError:
     raise ImportError("`pgvector` not installed, please install it via `pip install pgvector`.")
 
@@ -32,6 +40,70 @@ from vagents.vagentic.vectordb.base import VectorDb, Distance
 from vagents.vagentic.emb.openai_emb import OpenAIEmb
 
 
+# pgvector distance operators, by distance metric
+DISTANCE_OPERATORS: Dict[Distance, str] = {
+    Distance.cosine: "<=>",
+    Distance.l2: "<->",
+    Distance.max_inner_product: "<#>",
+}
+
+
+# Rows fetched per round-trip when search results are streamed; smaller limits are fetched at once
+SEARCH_YIELD_PER = 64
+
+
+def _embedding_to_list(embedding: Any) -> Optional[List[float]]:
+    """Convert a driver-decoded vector (numpy array or pgvector HalfVector) to a list of floats"""
+    if embedding is None:
+        return None
+    if hasattr(embedding, "to_list"):
+        return embedding.to_list()
+    if hasattr(embedding, "tolist"):
+        return embedding.tolist()
+    return list(embedding)
+
+
+def _normalized(embedding: List[float]) -> np.ndarray:
+    """Scale an embedding to unit length (zero vectors are returned unchanged)"""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def _register_vector_types(dbapi_connection: Any, connection_record: Any) -> None:
+    """Engine `connect` listener registering pgvector's psycopg/psycopg2 type adapters"""
+    driver = type(dbapi_connection).__module__.split(".")[0]
+    if driver == "psycopg":
+        from pgvector.psycopg import register_vector
+    elif driver == "psycopg2":
+        from pgvector.psycopg2 import register_vector
+    else:
+        return
+    try:
+        register_vector(dbapi_connection)
+    except Exception:
+        # The vector extension is not installed yet, `create` installs it
+        dbapi_connection.rollback()
+
+
+# HNSW parameters that disable size-tiered tuning when set explicitly
+HNSW_TUNED_FIELDS = {"m", "ef_construction", "ef_search"}
+
+# Largest hnsw.ef_search pgvector accepts
+HNSW_MAX_EF_SEARCH = 1000
+
+
+def _hnsw_tier(total_records: int) -> Tuple[int, int, int]:
+    """Returns (m, ef_construction, ef_search) for a collection of `total_records` rows"""
+    if total_records < 100000:
+        return 16, 64, 40
+    if total_records < 1000000:
+        return 24, 100, 100
+    return 32, 128, 200
+
+
 class Ivfflat(BaseModel):
     name: Optional[str] = None
     lists: int = 100
@@ -45,7 +117,7 @@ class Ivfflat(BaseModel):
 class HNSW(BaseModel):
     name: Optional[str] = None
     m: int = 16
-    ef_search: int = 5
+    ef_search: int = 40
     ef_construction: int = 200
     configuration: Dict[str, Any] = {
         "maintenance_work_mem": "2GB",
@@ -53,6 +125,37 @@ class HNSW(BaseModel):
 
 
 class PgVector(VectorDb):
+    """
+    Vector database backed by PostgreSQL + pgvector.
+
+    Embeddings are stored as `halfvec` (float16) by default, which halves heap and
+    index size with negligible recall loss; pass `precision="float32"` for `vector`.
+    Existing float32 collections can be migrated in place with:
+
+        ALTER TABLE ai.<collection> ALTER COLUMN embedding TYPE halfvec(<dimensions>);
+
+    (drop and rebuild the ANN index afterwards, it must use the `halfvec_*_ops` classes).
+
+    Setting `rerank_multiplier` adds a binary-quantized `embedding_bit` column with its own
+    HNSW index: search shortlists `limit * rerank_multiplier` candidates by hamming distance
+    and reranks them by full-precision distance. The shortlist is bounded by pgvector's
+    largest `hnsw.ef_search`, so `limit * rerank_multiplier` may not exceed 1000.
+
+    `insert` skips content hashes this instance has recently written or found stored without
+    asking the database. Deletes made by other instances or processes are not seen, so content
+    they remove is not re-inserted here; pass `seen_hashes_maxsize=0` when the collection is
+    shared with other writers that delete rows.
+
+    With `cache_local=True`, unfiltered searches use an in-process hnswlib index built from the
+    table on first use and rebuilt after this instance's writes. Rows written by other instances
+    or processes are not seen until `refresh_local_index()`, and collections with more than
+    `local_max_rows` rows are searched in SQL.
+
+    With `normalize=True` on a cosine collection, stored and query embeddings are scaled to
+    unit length and the index and search use inner product instead. Only enable it on new
+    collections, or after normalizing existing rows and rebuilding the index.
+    """
+
     def __init__(
             self,
             collection: str,
@@ -61,11 +164,22 @@ class PgVector(VectorDb):
             db_engine: Optional[Engine] = None,
             embedder: Optional[Emb] = None,
             distance: Distance = Distance.cosine,
+            precision: Literal["float32", "float16"] = "float16",
+            rerank_multiplier: Optional[int] = None,
             index: Optional[Union[Ivfflat, HNSW]] = HNSW(),
+            seen_hashes_maxsize: int = 100000,
+            max_parallel_workers: Optional[int] = None,
+            cache_local: bool = False,
+            local_max_rows: int = 100000,
+            normalize: bool = False,
     ):
         _engine: Optional[Engine] = db_engine
         if _engine is None and db_url is not None:
-            _engine = create_engine(db_url)
+            engine_kwargs: Dict[str, Any] = {"query_cache_size": 1200}
+            if make_url(db_url).get_driver_name() == "psycopg2":
+                # Send executemany() as multi-VALUES statements instead of one round-trip per row
+                engine_kwargs.update(executemany_mode="values_plus_batch", insertmanyvalues_page_size=1000)
+            _engine = create_engine(db_url, **engine_kwargs)
 
         if _engine is None:
             raise ValueError("Must provide either db_url or db_engine")
@@ -88,9 +202,44 @@ class PgVector(VectorDb):
 
         # Distance metric
         self.distance: Distance = distance
+        # Unit-normalize embeddings client-side so cosine collections can be indexed and
+        # searched with the cheaper inner product, which orders unit vectors identically
+        self.normalize: bool = normalize and distance == Distance.cosine
+        self.index_distance: Distance = Distance.max_inner_product if self.normalize else distance
+
+        # Storage precision of the embedding column
+        self.precision: Literal["float32", "float16"] = precision
+
+        # Candidate multiplier for the binary-quantized shortlist, None searches the full-precision index only
+        if rerank_multiplier is not None and rerank_multiplier < 1:
+            raise ValueError("rerank_multiplier must be at least 1")
+        self.rerank_multiplier: Optional[int] = rerank_multiplier
 
         # Index for the collection
         self.index: Optional[Union[Ivfflat, HNSW]] = index
+        # Parallel workers for index builds, defaults to the number of CPUs
+        self.max_parallel_workers: int = max_parallel_workers or os.cpu_count() or 1
+        # Size-tiered hnsw.ef_search for default HNSW parameters, derived on first use
+        self._ef_search: Optional[int] = None
+
+        # Content hashes known to be stored, checked before the database on insert (LRU, most recent last).
+        # About 160 bytes per hash, 0 disables it. Deletes by other instances or processes are not seen
+        self.seen_hashes_maxsize: int = seen_hashes_maxsize
+        self._seen_hashes: OrderedDict[str, None] = OrderedDict()
+        self._seen_hashes_lock: Lock = Lock()
+
+        # In-process hnswlib index over the whole collection, built on the first unfiltered search
+        self.cache_local: bool = cache_local
+        if self.cache_local:
+            try:
+                import hnswlib  # noqa: F401
+            except ImportError:
+                raise ImportError("`hnswlib` not installed, please install it via `pip install hnswlib`.")
+        # Collections above `local_max_rows` rows are searched in SQL instead
+        self.local_max_rows: int = local_max_rows
+        self._local_index: Optional[Any] = None
+        self._local_ids: List[str] = []
+        self._local_index_oversized: bool = False
 
         # Database session
         self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
@@ -98,7 +247,45 @@ class PgVector(VectorDb):
         # Database table for the collection
         self.table: Table = self.get_table()
 
+        # Write statements, built once and executed with a list of rows per batch
+        self._insert_stmt = postgresql.insert(self.table)
+        # Update row when id matches but 'content_hash' is different
+        self._upsert_stmt = self._insert_stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_=dict(
+                name=self._insert_stmt.excluded.name,
+                meta_data=self._insert_stmt.excluded.meta_data,
+                content=self._insert_stmt.excluded.content,
+                embedding=self._insert_stmt.excluded.embedding,
+                usage=self._insert_stmt.excluded.usage,
+                content_hash=self._insert_stmt.excluded.content_hash,
+            ),
+        )
+
+        # Neighbor ordering, built once and bound to the query embedding at search time
+        self._order_by = self.table.c.embedding.op(DISTANCE_OPERATORS[self.index_distance], return_type=Float)(
+            bindparam("query_embedding", type_=self.table.c.embedding.type)
+        )
+        if self.rerank_multiplier is not None:
+            self._bit_order_by = self.table.c.embedding_bit.op("<~>", return_type=Float)(
+                func.binary_quantize(cast(bindparam("query_embedding"), self.table.c.embedding.type))
+            )
+
+        # Let the driver encode/decode vector types natively on new connections
+        # (one listener per engine, shared by every collection on it)
+        if not event.contains(self.db_engine, "connect", _register_vector_types):
+            event.listen(self.db_engine, "connect", _register_vector_types)
+
     def get_table(self) -> Table:
+        extra_columns: List[Column] = []
+        if self.rerank_multiplier is not None:
+            extra_columns.append(
+                Column(
+                    "embedding_bit",
+                    BIT(self.dimensions),
+                    Computed(f"binary_quantize(embedding)::bit({self.dimensions})", persisted=True),
+                )
+            )
         return Table(
             self.collection,
             self.metadata,
@@ -106,11 +293,13 @@ class PgVector(VectorDb):
             Column("name", String),
             Column("meta_data", postgresql.JSONB, server_default=text("'{}'::jsonb")),
             Column("content", postgresql.TEXT),
-            Column("embedding", Vector(self.dimensions)),
+            Column("embedding", HALFVEC(self.dimensions) if self.precision == "float16" else Vector(self.dimensions)),
             Column("usage", postgresql.JSONB),
             Column("created_at", DateTime(timezone=True), server_default=text("now()")),
             Column("updated_at", DateTime(timezone=True), onupdate=text("now()")),
             Column("content_hash", String),
+            *extra_columns,
+            Index(f"{self.collection}_content_hash_index", "content_hash"),
             extend_existing=True,
         )
 
@@ -130,6 +319,25 @@ class PgVector(VectorDb):
                         sess.execute(text(f"create schema if not exists {self.schema};"))
             self.table.create(self.db_engine)
 
+    def _read_connection(self) -> Connection:
+        """Pooled connection in autocommit mode, so single-statement reads skip BEGIN/COMMIT"""
+        return self.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+    def _apply_search_settings(self, conn: Connection, settings: Dict[str, Any]) -> None:
+        """
+        Set search GUCs at session level, sending SET only when the pooled connection
+        does not already carry the value.
+
+        Args:
+            conn (Connection): Autocommit connection from `_read_connection`
+            settings (Dict[str, Any]): GUC names and values
+        """
+        applied: Dict[str, Any] = conn.info.setdefault("pgvector_settings", {})
+        for key, value in settings.items():
+            if applied.get(key) != value:
+                conn.execute(text(f"SET {key} = {value}"))
+                applied[key] = value
+
     def doc_exists(self, document: Document) -> bool:
         """
         Validating if the document exists or not
@@ -137,14 +345,22 @@ class PgVector(VectorDb):
         Args:
             document (Document): Document to validate
         """
-        columns = [self.table.c.name, self.table.c.content_hash]
-        with self.Session() as sess:
-            with sess.begin():
-                cleaned_content = document.content.replace("\x00", "\ufffd")
-                stmt = select(*columns).where(self.table.c.content_hash == md5(
-                    cleaned_content.encode()).hexdigest())
-                result = sess.execute(stmt).first()
-                return result is not None
+        with self._read_connection() as conn:
+            stmt = select(exists().where(self.table.c.content_hash == document.content_hash))
+            return bool(conn.execute(stmt).scalar())
+
+    def existing_hashes(self, hashes: List[str]) -> Set[str]:
+        """
+        Return the subset of content hashes already stored, in a single query
+
+        Args:
+            hashes (List[str]): Content hashes to look up
+        """
+        if not hashes:
+            return set()
+        with self._read_connection() as conn:
+            stmt = select(self.table.c.content_hash).where(self.table.c.content_hash.in_(hashes))
+            return {row[0] for row in conn.execute(stmt)}
 
     def name_exists(self, name: str) -> bool:
         """
@@ -153,11 +369,9 @@ class PgVector(VectorDb):
         Args:
             name (str): Name to check
         """
-        with self.Session() as sess:
-            with sess.begin():
-                stmt = select(self.table.c.name).where(self.table.c.name == name)
-                result = sess.execute(stmt).first()
-                return result is not None
+        with self._read_connection() as conn:
+            stmt = select(exists().where(self.table.c.name == name))
+            return bool(conn.execute(stmt).scalar())
 
     def id_exists(self, id: str) -> bool:
         """
@@ -166,40 +380,204 @@ class PgVector(VectorDb):
         Args:
             id (str): Id to check
         """
-        with self.Session() as sess:
-            with sess.begin():
-                stmt = select(self.table.c.id).where(self.table.c.id == id)
-                result = sess.execute(stmt).first()
-                return result is not None
+        with self._read_connection() as conn:
+            stmt = select(exists().where(self.table.c.id == id))
+            return bool(conn.execute(stmt).scalar())
+
+    def _embed_batch(self, documents: List[Document]) -> None:
+        """
+        Embed a batch of documents with a single embedder call
+
+        Args:
+            documents (List[Document]): Documents to embed in place
+        """
+        if not documents:
+            return
+        texts = [document.content for document in documents]
+        if hasattr(self.embedder, "get_embeddings_and_usage"):
+            embeddings, usages = self.embedder.get_embeddings_and_usage(texts)
+        else:
+            embeddings, usages = self.embedder.get_embeddings(texts), [None] * len(documents)
+        for document, embedding, usage in zip(documents, embeddings, usages):
+            document.embedding = _normalized(embedding).tolist() if self.normalize else embedding
+            document.usage = usage
+
+    def _remember_hashes(self, hashes: Iterable[str]) -> None:
+        with self._seen_hashes_lock:
+            for content_hash in hashes:
+                self._seen_hashes[content_hash] = None
+                self._seen_hashes.move_to_end(content_hash)
+            while len(self._seen_hashes) > self.seen_hashes_maxsize:
+                self._seen_hashes.popitem(last=False)
+
+    def _forget_hashes(self) -> None:
+        with self._seen_hashes_lock:
+            self._seen_hashes.clear()
+
+    def _new_documents(self, documents: List[Document], queued: Set[str]) -> List[Document]:
+        """
+        Drop documents whose content is already stored, queued by an earlier batch of the
+        same call, or repeated earlier in the batch. Hashes seen by this instance are
+        skipped without querying the database.
+
+        Args:
+            documents (List[Document]): Documents to filter
+            queued (Set[str]): Content hashes kept from earlier batches, updated in place
+        """
+        unseen: List[Document] = []
+        with self._seen_hashes_lock:
+            for document in documents:
+                if document.content_hash in queued:
+                    continue
+                if document.content_hash in self._seen_hashes:
+                    self._seen_hashes.move_to_end(document.content_hash)
+                else:
+                    unseen.append(document)
+
+        seen = self.existing_hashes([document.content_hash for document in unseen])
+        self._remember_hashes(seen)
+        new_documents: List[Document] = []
+        for document in unseen:
+            if document.content_hash not in seen:
+                seen.add(document.content_hash)
+                queued.add(document.content_hash)
+                new_documents.append(document)
+        return new_documents
+
+    def _prepare_batch(self, documents: List[Document], queued: Optional[Set[str]]) -> List[Document]:
+        if queued is not None:
+            documents = self._new_documents(documents, queued)
+        self._embed_batch(documents)
+        return documents
+
+    def _embedded_batches(
+            self, documents: List[Document], batch_size: int, skip_existing: bool = False
+    ) -> Iterator[List[Document]]:
+        """
+        Yield embedded chunks of `batch_size` documents, preparing the next chunk
+        in the background while the caller writes the current one.
+
+        Args:
+            documents (List[Document]): Documents to embed
+            batch_size (int): Number of documents per chunk
+            skip_existing (bool): Drop documents whose content hash is already stored before embedding
+        """
+        batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+        if not batches:
+            return
+        # The next batch is filtered before the current one is written, so the database cannot
+        # see its rows yet; hashes kept by earlier batches of this call are tracked here instead.
+        # Batches are prepared one at a time on a single worker, so the set needs no lock.
+        queued: Optional[Set[str]] = set() if skip_existing else None
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self._prepare_batch, batches[0], queued)
+            for i in range(len(batches)):
+                batch = future.result()
+                if i + 1 < len(batches):
+                    future = executor.submit(self._prepare_batch, batches[i + 1], queued)
+                yield batch
+
+    def _document_row(self, document: Document) -> Dict[str, Any]:
+        return dict(
+            id=document.id or document.content_hash,
+            name=document.name,
+            meta_data=document.meta_data,
+            content=document.cleaned_content,
+            embedding=document.embedding,
+            usage=document.usage,
+            content_hash=document.content_hash,
+        )
 
     def insert(self, documents: List[Document], batch_size: int = 10) -> None:
+        """
+        Insert documents into the database, one executemany() per batch.
+        Documents whose content is already stored are skipped before embedding.
+
+        Args:
+            documents (List[Document]): List of documents to insert
+            batch_size (int): Number of documents embedded and inserted together
+        """
+        batches = self._embedded_batches(documents, batch_size, skip_existing=True)
         with self.Session() as sess:
-            counter = 0
-            for document in tqdm(documents, desc="Inserting documents"):
-                document.embed(embedder=self.embedder)
-                cleaned_content = document.content.replace("\x00", "\ufffd")
-                content_hash = md5(cleaned_content.encode()).hexdigest()
-                _id = document.id or content_hash
-                stmt = postgresql.insert(self.table).values(
-                    id=_id,
-                    name=document.name,
-                    meta_data=document.meta_data,
-                    content=cleaned_content,
-                    embedding=document.embedding,
-                    usage=document.usage,
-                    content_hash=content_hash,
-                )
-                sess.execute(stmt)
-                counter += 1
+            for batch in tqdm(batches, total=ceil(len(documents) / batch_size), desc="Inserting batches"):
+                if not batch:
+                    continue
+                # Each batch gets its own transaction
+                with sess.begin():
+                    sess.execute(self._insert_stmt, [self._document_row(d) for d in batch])
+                self._remember_hashes(document.content_hash for document in batch)
+                self._local_index = None
 
-                # Commit every `batch_size` documents
-                if counter >= batch_size:
-                    sess.commit()
-                    counter = 0
+    def bulk_load(self, documents: List[Document], threshold: int = 5000, batch_size: int = 1000) -> None:
+        """
+        Load a large corpus with binary COPY instead of INSERT.
+
+        Intended for the initial load of a collection: rows are not deduplicated, so an
+        id that already exists fails the whole COPY. When the table is empty, the ANN
+        indexes are dropped before the load and rebuilt by `optimize` afterwards, also when
+        the load fails. A non-empty table keeps its indexes, which COPY then maintains row
+        by row. Either way, searches are not blocked while documents are embedded and copied.
+        Falls back to `insert` for `threshold` documents or fewer, or when the engine does
+        not use psycopg (v3).
+
+        Args:
+            documents (List[Document]): List of documents to load
+            threshold (int): Minimum number of documents for the COPY path
+            batch_size (int): Number of documents embedded together
+        """
+        if len(documents) <= threshold or self.db_engine.dialect.driver != "psycopg":
+            self.insert(documents, batch_size=batch_size)
+            return
 
-            # Commit any remaining documents
-            if counter > 0:
-                sess.commit()
+        try:
+            from pgvector.psycopg import register_vector
+        except ImportError:
+            raise ImportError("`psycopg` not installed, please install it via `pip install psycopg`.")
+
+        columns = ["id", "name", "meta_data", "content", "embedding", "usage", "content_hash"]
+        vector_type = "halfvec" if self.precision == "float16" else "vector"
+        schema_prefix = f"{self.schema}." if self.schema is not None else ""
+        ann_indexes = []
+        if self.index is not None:
+            ann_indexes.append(f"{schema_prefix}{self._index_name()}")
+        if self.rerank_multiplier is not None:
+            ann_indexes.append(f"{schema_prefix}{self.collection}_bit_index")
+
+        indexes_dropped = False
+        raw_connection = self.db_engine.raw_connection()
+        try:
+            conn = raw_connection.driver_connection
+            register_vector(conn)
+            with conn.cursor() as cur, tqdm(total=len(documents), desc="Loading documents") as progress:
+                # Building the ANN indexes once after the load beats maintaining them per row. Only
+                # done on an empty table, in its own short transaction: dropping an index locks out
+                # readers until commit, and the load below runs as long as embedding the corpus
+                cur.execute(f"SELECT EXISTS (SELECT 1 FROM {self.table})")
+                if ann_indexes and not cur.fetchone()[0]:
+                    for index_name in ann_indexes:
+                        cur.execute(f"DROP INDEX IF EXISTS {index_name};")
+                    conn.commit()
+                    indexes_dropped = True
+                with cur.copy(f"COPY {self.table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT BINARY)") as copy:
+                    copy.set_types(["text", "text", "jsonb", "text", vector_type, "jsonb", "text"])
+                    for batch in self._embedded_batches(documents, batch_size):
+                        for document in batch:
+                            row = self._document_row(document)
+                            copy.write_row([row[column] for column in columns])
+                        progress.update(len(batch))
+            conn.commit()
+            self._remember_hashes(document.content_hash for document in documents)
+            self._local_index = None
+        except Exception:
+            raw_connection.rollback()
+            if indexes_dropped:
+                # Restore the indexes dropped for the load
+                self.optimize()
+            raise
+        finally:
+            raw_connection.close()
+
+        self.optimize()
 
     def upsert_available(self) -> bool:
         return True
@@ -210,60 +588,146 @@ class PgVector(VectorDb):
 
         Args:
             documents (List[Document]): List of documents to upsert
-            batch_size (int): Batch size for upserting documents
+            batch_size (int): Number of documents embedded and upserted together
         """
         with self.Session() as sess:
-            counter = 0
-            for document in documents:
-                document.embed(embedder=self.embedder)
-                cleaned_content = document.content.replace("\x00", "\ufffd")
-                content_hash = md5(cleaned_content.encode()).hexdigest()
-                _id = document.id or content_hash
-                stmt = postgresql.insert(self.table).values(
-                    id=_id,
-                    name=document.name,
-                    meta_data=document.meta_data,
-                    content=cleaned_content,
-                    embedding=document.embedding,
-                    usage=document.usage,
-                    content_hash=content_hash,
-                )
-                # Update row when id matches but 'content_hash' is different
-                stmt = stmt.on_conflict_do_update(
-                    index_elements=["id"],
-                    set_=dict(
-                        name=stmt.excluded.name,
-                        meta_data=stmt.excluded.meta_data,
-                        content=stmt.excluded.content,
-                        embedding=stmt.excluded.embedding,
-                        usage=stmt.excluded.usage,
-                        content_hash=stmt.excluded.content_hash,
-                    ),
-                )
-                sess.execute(stmt)
-                counter += 1
+            for batch in self._embedded_batches(documents, batch_size):
+                # Keyed by id: a single INSERT ... ON CONFLICT cannot touch the same row twice
+                rows = {row["id"]: row for row in map(self._document_row, batch)}
+                # Each batch gets its own transaction
+                with sess.begin():
+                    sess.execute(self._upsert_stmt, list(rows.values()))
+        # Upserts may replace the content behind an id, so previously seen hashes can be stale
+        self._forget_hashes()
+        self._local_index = None
+
+    def _to_documents(self, neighbors: Iterable[Any], return_embedding: bool) -> List[Document]:
+        # Rows come from our own table, so skip pydantic validation
+        return [
+            Document.model_construct(
+                name=neighbor.name,
+                meta_data=neighbor.meta_data,
+                content=neighbor.content,
+                embedder=self.embedder,
+                embedding=_embedding_to_list(neighbor.embedding) if return_embedding else None,
+                usage=neighbor.usage,
+            )
+            for neighbor in neighbors
+        ]
+
+    def _load_local_index(self) -> bool:
+        """
+        Build an in-process hnswlib index over every embedding in the collection.
+        Returns False, leaving no index, when the collection has more than `local_max_rows` rows.
+        """
+        import hnswlib
+
+        with self._read_connection() as conn:
+            stmt = (
+                select(self.table.c.id, self.table.c.embedding)
+                .where(self.table.c.embedding.is_not(None))
+                .limit(self.local_max_rows + 1)
+            )
+            rows = conn.execute(stmt).fetchall()
+        if len(rows) > self.local_max_rows:
+            self._local_index, self._local_ids = None, []
+            self._local_index_oversized = True
+            return False
 
-                # Commit every `batch_size` documents
-                if counter >= batch_size:
-                    sess.commit()
-                    counter = 0
+        space = {Distance.cosine: "cosine", Distance.l2: "l2", Distance.max_inner_product: "ip"}[self.index_distance]
+        local_index = hnswlib.Index(space=space, dim=self.dimensions)
+        local_index.init_index(max_elements=max(len(rows), 1), ef_construction=200, M=16)
+        if rows:
+            embeddings = np.asarray([_embedding_to_list(row.embedding) for row in rows], dtype=np.float32)
+            local_index.add_items(embeddings, np.arange(len(rows)))
+        self._local_ids = [row.id for row in rows]
+        self._local_index = local_index
+        self._local_index_oversized = False
+        return True
+
+    def refresh_local_index(self) -> None:
+        """
+        Rebuild the in-process index from the database, picking up rows written by other
+        instances or processes. Searches fall back to SQL if the collection has grown past
+        `local_max_rows`.
+        """
+        if self.cache_local:
+            self._load_local_index()
 
-            # Commit any remaining documents
-            if counter > 0:
-                sess.commit()
+    def _search_local(self, query_embedding: List[float], columns: List[Column], limit: int) -> Optional[List[Any]]:
+        """
+        Find neighbors with the in-process index, then fetch their rows by id.
+        Returns None when the collection is too large for the in-process index.
+
+        Args:
+            query_embedding (List[float]): Embedded query
+            columns (List[Column]): Columns to fetch for each neighbor
+            limit (int): Maximum number of neighbors
+        """
+        if self._local_index is None and not self._load_local_index():
+            return None
+        k = min(limit, len(self._local_ids))
+        if k == 0:
+            return []
+
+        self._local_index.set_ef(max(self._get_ef_search() or 40, k))
+        labels, _ = self._local_index.knn_query(np.asarray(query_embedding, dtype=np.float32), k=k)
+        ids = [self._local_ids[label] for label in labels[0]]
+
+        with self._read_connection() as conn:
+            stmt = select(*columns, self.table.c.id).where(self.table.c.id.in_(ids))
+            rows = {row.id: row for row in conn.execute(stmt)}
+        return [rows[_id] for _id in ids if _id in rows]
+
+    def search(
+            self,
+            query: str,
+            limit: int = 5,
+            filters: Optional[Dict[str, Any]] = None,
+            return_embedding: bool = False,
+    ) -> List[Document]:
+        """
+        Search the collection for the documents nearest to the query.
+
+        Args:
+            query (str): Query text to embed and search for
+            limit (int): Maximum number of documents to return
+            filters (Optional[Dict[str, Any]]): Column equality filters
+            return_embedding (bool): Fetch the stored embedding with each document
+        """
+        # The shortlist is read from one HNSW scan, which returns at most hnsw.ef_search rows
+        if self.rerank_multiplier is not None and limit * self.rerank_multiplier > HNSW_MAX_EF_SEARCH:
+            raise ValueError(
+                f"limit * rerank_multiplier ({limit * self.rerank_multiplier}) exceeds {HNSW_MAX_EF_SEARCH}, "
+                "the largest hnsw.ef_search pgvector accepts"
+            )
 
-    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
         query_embedding = self.embedder.get_embedding(query)
         if query_embedding is None:
             return []
+        if self.normalize:
+            query_embedding = _normalized(query_embedding)
 
         columns = [
             self.table.c.name,
             self.table.c.meta_data,
             self.table.c.content,
-            self.table.c.embedding,
             self.table.c.usage,
         ]
+        if return_embedding:
+            columns.append(self.table.c.embedding)
+
+        # Unfiltered searches can be answered by the in-process index, unless the collection outgrew it
+        if self.cache_local and filters is None and not self._local_index_oversized:
+            try:
+                neighbors = self._search_local(query_embedding, columns, limit)
+            except ProgrammingError:
+                if self.table_exists():
+                    raise
+                self.create()
+                return []
+            if neighbors is not None:
+                return self._to_documents(neighbors, return_embedding)
 
         stmt = select(*columns)
 
@@ -272,110 +736,207 @@ class PgVector(VectorDb):
                 if hasattr(self.table.c, key):
                     stmt = stmt.where(getattr(self.table.c, key) == value)
 
-        if self.distance == Distance.l2:
-            stmt = stmt.order_by(self.table.c.embedding.max_inner_product(query_embedding))
-        if self.distance == Distance.cosine:
-            stmt = stmt.order_by(self.table.c.embedding.cosine_distance(query_embedding))
-        if self.distance == Distance.max_inner_product:
-            stmt = stmt.order_by(self.table.c.embedding.max_inner_product(query_embedding))
-
-        stmt = stmt.limit(limit=limit)
+        num_candidates = 0
+        if self.rerank_multiplier is None:
+            stmt = stmt.order_by(self._order_by).limit(limit=limit)
+        else:
+            # Shortlist candidates on the binary-quantized index, then rerank them at full precision
+            num_candidates = limit * self.rerank_multiplier
+            if not return_embedding:
+                stmt = stmt.add_columns(self.table.c.embedding)
+            candidates = stmt.order_by(self._bit_order_by).limit(num_candidates).subquery()
+            stmt = (
+                select(*[candidates.c[column.name] for column in columns])
+                .order_by(
+                    candidates.c.embedding.op(DISTANCE_OPERATORS[self.index_distance], return_type=Float)(
+                        bindparam("query_embedding", type_=self.table.c.embedding.type)
+                    )
+                )
+                .limit(limit=limit)
+            )
 
-        # Get neighbors
+        # Get neighbors and build search results
+        params = {"query_embedding": query_embedding}
         try:
-            with self.Session() as sess:
-                with sess.begin():
-                    if self.index is not None:
-                        if isinstance(self.index, Ivfflat):
-                            sess.execute(text(f"SET LOCAL ivfflat.probes = {self.index.probes}"))
-                        elif isinstance(self.index, HNSW):
-                            sess.execute(text(f"SET LOCAL hnsw.ef_search  = {self.index.ef_search}"))
-                    neighbors = sess.execute(stmt).fetchall() or []
-        except Exception as e:
+            settings: Dict[str, Any] = {}
+            if isinstance(self.index, Ivfflat):
+                settings["ivfflat.probes"] = self.index.probes
+            ef_search = self._get_ef_search()
+            if num_candidates:
+                # The HNSW scan over embedding_bit returns at most ef_search candidates
+                ef_search = max(ef_search or 0, num_candidates)
+            if ef_search is not None:
+                settings["hnsw.ef_search"] = min(ef_search, HNSW_MAX_EF_SEARCH)
+
+            with self._read_connection() as conn:
+                self._apply_search_settings(conn, settings)
+                if limit <= SEARCH_YIELD_PER:
+                    neighbors = conn.execute(stmt, params).fetchall() or []
+                else:
+                    # Stream large result sets through a server-side cursor, which needs a transaction.
+                    # End the autobegun (no-op) transaction first, the isolation level cannot change inside it
+                    conn.commit()
+                    conn.execution_options(isolation_level=self.db_engine.dialect.default_isolation_level)
+                    conn.begin()
+                    neighbors = conn.execute(
+                        stmt, params, execution_options={"stream_results": True, "yield_per": SEARCH_YIELD_PER}
+                    )
+                search_results = self._to_documents(neighbors, return_embedding)
+        except ProgrammingError:
+            # Only a missing collection table means "no results"; anything else is a real failure
+            if self.table_exists():
+                raise
             self.create()
             return []
 
-        # Build search results
-        search_results: List[Document] = []
-        for neighbor in neighbors:
-            search_results.append(
-                Document(
-                    name=neighbor.name,
-                    meta_data=neighbor.meta_data,
-                    content=neighbor.content,
-                    embedder=self.embedder,
-                    embedding=neighbor.embedding,
-                    usage=neighbor.usage,
-                )
-            )
-
         return search_results
 
     def delete(self) -> None:
         if self.table_exists():
             self.table.drop(self.db_engine)
+        self._forget_hashes()
+        self._local_index = None
+        self._local_index_oversized = False
 
     def exists(self) -> bool:
         return self.table_exists()
 
     def get_count(self) -> int:
-        with self.Session() as sess:
-            with sess.begin():
-                stmt = select(func.count(self.table.c.name)).select_from(self.table)
-                result = sess.execute(stmt).scalar()
-                if result is not None:
-                    return int(result)
-                return 0
+        with self._read_connection() as conn:
+            stmt = select(func.count()).select_from(self.table)
+            result = conn.execute(stmt).scalar()
+            if result is not None:
+                return int(result)
+            return 0
+
+    def _estimated_count(self) -> int:
+        """
+        Row count from the planner statistics in pg_class, which avoids scanning the table.
+        Falls back to an exact count when the table has never been analyzed.
+        """
+        with self._read_connection() as conn:
+            stmt = text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)")
+            result = conn.execute(stmt, {"name": str(self.table)}).scalar()
+        if result is None or result <= 0:
+            return self.get_count()
+        return int(result)
+
+    def _get_ef_search(self) -> Optional[int]:
+        """
+        hnsw.ef_search used by search: the configured value, or for default HNSW parameters
+        the size tier's value, so every instance on a collection agrees with what `optimize` built
+        """
+        if not isinstance(self.index, HNSW):
+            return None
+        if self.index.model_fields_set & HNSW_TUNED_FIELDS:
+            return self.index.ef_search
+        if self._ef_search is None:
+            self._ef_search = _hnsw_tier(self._estimated_count())[2]
+        return self._ef_search
+
+    def _index_name(self) -> str:
+        if self.index.name is not None:
+            return self.index.name
+        _type = "ivfflat" if isinstance(self.index, Ivfflat) else "hnsw"
+        return f"{self.collection}_{_type}_index"
+
+    def _create_index(self, index_name: str, definition: str, settings: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Build an index with CREATE INDEX CONCURRENTLY, so writers are not blocked meanwhile.
+
+        CONCURRENTLY cannot run inside a transaction, so this uses an autocommit connection:
+        build settings are applied at session level in one statement and reset afterwards
+        in another. An index left invalid by an interrupted concurrent build is rebuilt
+        with REINDEX CONCURRENTLY.
+
+        Args:
+            index_name (str): Unqualified index name
+            definition (str): Everything after `ON <table>`, e.g. `USING hnsw (...)`
+            settings (Optional[Dict[str, Any]]): Session settings for the build
+        """
+        qualified_name = f"{self.schema}.{index_name}" if self.schema is not None else index_name
+        settings = {
+            "max_parallel_maintenance_workers": self.max_parallel_workers,
+            "max_parallel_workers": self.max_parallel_workers,
+            **(settings or {}),
+        }
+        params = {f"value_{i}": str(value) for i, value in enumerate(settings.values())}
+        params.update({f"key_{i}": key for i, key in enumerate(settings)})
+        set_configs = ", ".join(f"set_config(:key_{i}, :value_{i}, false)" for i in range(len(settings)))
+
+        with self.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"SELECT {set_configs};"), params)
+            try:
+                conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {self.table} {definition};"))
+                stmt = text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)")
+                if conn.execute(stmt, {"name": qualified_name}).scalar() is False:
+                    conn.execute(text(f"REINDEX INDEX CONCURRENTLY {qualified_name};"))
+            finally:
+                conn.execute(
+                    text("SELECT set_config(name, reset_val, false) FROM pg_settings WHERE name = ANY(:names);"),
+                    {"names": list(settings)},
+                )
 
     def optimize(self) -> None:
+        """
+        Create the ANN index for the collection.
+
+        Indexes are built concurrently, so the collection stays writable during the build,
+        with up to `max_parallel_workers` parallel maintenance workers (pgvector >= 0.6 for
+        HNSW). On older pgvector, HNSW builds are single-threaded; the faster route there
+        is to create the index on the empty table and load it with several concurrent
+        `insert` workers instead of calling this afterwards.
+        """
         from math import sqrt
 
+        # Collections created before the content_hash index existed get it here
+        self._create_index(f"{self.collection}_content_hash_index", "(content_hash)")
+
+        if self.rerank_multiplier is not None:
+            self._create_index(f"{self.collection}_bit_index", "USING hnsw (embedding_bit bit_hamming_ops)")
+
         if self.index is None:
             return
 
-        if self.index.name is None:
-            _type = "ivfflat" if isinstance(self.index, Ivfflat) else "hnsw"
-            self.index.name = f"{self.collection}_{_type}_index"
+        index_name = self._index_name()
 
-        index_distance = "vector_cosine_ops"
-        if self.distance == Distance.l2:
-            index_distance = "vector_l2_ops"
-        if self.distance == Distance.max_inner_product:
-            index_distance = "vector_ip_ops"
+        vector_type = "halfvec" if self.precision == "float16" else "vector"
+        index_distance = f"{vector_type}_cosine_ops"
+        if self.index_distance == Distance.l2:
+            index_distance = f"{vector_type}_l2_ops"
+        if self.index_distance == Distance.max_inner_product:
+            index_distance = f"{vector_type}_ip_ops"
 
         if isinstance(self.index, Ivfflat):
             num_lists = self.index.lists
             if self.index.dynamic_lists:
-                total_records = self.get_count()
+                total_records = self._estimated_count()
                 if total_records < 1000000:
                     num_lists = int(total_records / 1000)
                 elif total_records > 1000000:
                     num_lists = int(sqrt(total_records))
 
-            with self.Session() as sess:
-                with sess.begin():
-                    for key, value in self.index.configuration.items():
-                        sess.execute(text(f"SET {key} = '{value}';"))
-                    sess.execute(text(f"SET ivfflat.probes = {self.index.probes};"))
-                    sess.execute(
-                        text(
-                            f"CREATE INDEX IF NOT EXISTS {self.index.name} ON {self.table} "
-                            f"USING ivfflat (embedding {index_distance}) "
-                            f"WITH (lists = {num_lists});"
-                        )
-                    )
+            self._create_index(
+                index_name,
+                f"USING ivfflat (embedding {index_distance}) WITH (lists = {num_lists})",
+                self.index.configuration,
+            )
         elif isinstance(self.index, HNSW):
-            with self.Session() as sess:
-                with sess.begin():
-                    for key, value in self.index.configuration.items():
-                        sess.execute(text(f"SET {key} = '{value}';"))
-                    sess.execute(
-                        text(
-                            f"CREATE INDEX IF NOT EXISTS {self.index.name} ON {self.table} "
-                            f"USING hnsw (embedding {index_distance}) "
-                            f"WITH (m = {self.index.m}, ef_construction = {self.index.ef_construction});"
-                        )
-                    )
+            m, ef_construction = self.index.m, self.index.ef_construction
+            configuration = dict(self.index.configuration)
+            # Size-tiered parameters, unless the caller picked any of them explicitly
+            if not self.index.model_fields_set & HNSW_TUNED_FIELDS:
+                total_records = self._estimated_count()
+                m, ef_construction, self._ef_search = _hnsw_tier(total_records)
+                # Keep the graph in memory while building large indexes, unless configured explicitly
+                if total_records >= 1000000 and "configuration" not in self.index.model_fields_set:
+                    configuration["maintenance_work_mem"] = "4GB"
+
+            self._create_index(
+                index_name,
+                f"USING hnsw (embedding {index_distance}) WITH (m = {m}, ef_construction = {ef_construction})",
+                configuration,
+            )
 
     def clear(self) -> bool:
         from sqlalchemy import delete
@@ -384,4 +945,7 @@ class PgVector(VectorDb):
             with sess.begin():
                 stmt = delete(self.table)
                 sess.execute(stmt)
+                self._forget_hashes()
+                self._local_index = None
+                self._local_index_oversized = False
                 return True
@@ -0,0 +1,83 @@
+import sys
+sys.path.append(".")
+
+from typing import List
+
+from sqlalchemy import create_engine
+
+from vagents.vagentic.document import Document
+from vagents.vagentic.emb.base import Emb
+from vagents.vagentic.vectordb.pgvector import PgVector
+
+
+class FakeEmb(Emb):
+    dimensions: int = 2
+
+    def get_embedding(self, text: str) -> List[float]:
+        return [float(len(text)), 1.0]
+
+
+class FakeDb:
+    """
+    Rows written through FakeSession. Lookups only see rows written before the current
+    insert call, the worst case where each batch is filtered before the previous one is written
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.visible_hashes = set()
+
+    def publish(self):
+        self.visible_hashes = {row["content_hash"] for row in self.rows.values()}
+
+
+class FakeSession:
+    """Stands in for a SQLAlchemy Session, writing executed rows into a FakeDb"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def begin(self):
+        return self
+
+    def execute(self, stmt, rows):
+        for row in rows:
+            assert row["id"] not in self.db.rows, f"duplicate key {row['id']}"
+            self.db.rows[row["id"]] = row
+
+
+def make_pgvector(db, **kwargs) -> PgVector:
+    # The engine never connects: writes and hash lookups go to the FakeDb
+    vector_db = PgVector("test", db_engine=create_engine("sqlite://"), embedder=FakeEmb(), **kwargs)
+    vector_db.Session = lambda: FakeSession(db)
+    vector_db.existing_hashes = lambda hashes: db.visible_hashes & set(hashes)
+    return vector_db
+
+
+def test_insert_skips_duplicates_across_batches():
+    db = FakeDb()
+    # Without the seen-hash cache, only hashes queued by earlier batches of the call catch the repeat
+    vector_db = make_pgvector(db, seen_hashes_maxsize=0)
+    vector_db.insert([Document(content=content) for content in ["a", "b", "c", "b"]], batch_size=2)
+    assert sorted(row["content"] for row in db.rows.values()) == ["a", "b", "c"]
+
+
+def test_insert_skips_stored_content():
+    db = FakeDb()
+    # Without the seen-hash cache, stored content is only found through the database lookup
+    vector_db = make_pgvector(db, seen_hashes_maxsize=0)
+    vector_db.insert([Document(content="a"), Document(content="b")], batch_size=1)
+    db.publish()
+    vector_db.insert([Document(content="b"), Document(content="c")], batch_size=1)
+    assert sorted(row["content"] for row in db.rows.values()) == ["a", "b", "c"]
+
+
+if __name__ == "__main__":
+    test_insert_skips_duplicates_across_batches()
+    test_insert_skips_stored_content()